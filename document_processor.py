@@ -3,28 +3,178 @@ Document Processor for extracting text from PDF HVAC manuals.
 Handles PDF text extraction and prepares content for LLM context window.
 """
 
+import asyncio
+import functools
+import hashlib
+import json
+import multiprocessing
 import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 from typing import List, Optional
-import PyPDF2
+import faiss
+import fitz  # PyMuPDF
+import numpy as np
+import tiktoken
+from openai import OpenAI
 import logging
 
 logger = logging.getLogger(__name__)
 
+EMBEDDING_MODEL = "text-embedding-3-small"
+CHUNK_TOKENS = 500
+CHUNK_OVERLAP = 50
+EMBED_BATCH_SIZE = 512
+EMBED_CONCURRENCY = 5
+
+# PDFs up to this size are read fully into memory before parsing; the PDF
+# xref structure is random-access and in-memory buffers avoid a kernel
+# read() per seek. Larger files are opened from disk. Keep this small:
+# every extraction pool worker opening the same file pays it again, so
+# the worst-case RSS is roughly this value times the pool size.
+MAX_INMEMORY_PDF_BYTES = 32 * 1024 * 1024
+
+
+# Process-wide extraction pool, created lazily by _get_pdf_executor
+_pdf_executor: Optional[ProcessPoolExecutor] = None
+_pdf_executor_lock = threading.Lock()
+
+
+def _get_pdf_executor() -> ProcessPoolExecutor:
+    """
+    Return the shared page-extraction pool, creating it on first use.
+
+    forkserver rather than the default fork context: extractions run from
+    several asyncio.to_thread threads concurrently, and forking a
+    multithreaded process can deadlock children on inherited locks (the
+    logging lock in particular; Python 3.12+ deprecates exactly this).
+    One shared pool also avoids spinning up and tearing down cpu_count
+    workers for every PDF.
+    """
+    global _pdf_executor
+    with _pdf_executor_lock:
+        if _pdf_executor is None:
+            _pdf_executor = ProcessPoolExecutor(
+                max_workers=os.cpu_count() or 1,
+                mp_context=multiprocessing.get_context("forkserver"),
+            )
+        return _pdf_executor
+
+
+@functools.lru_cache(maxsize=1)
+def get_shared_processor(documents_dir: str = "./documents") -> "DocumentProcessor":
+    """
+    Return the process-wide shared DocumentProcessor.
+
+    A LiveKit worker handles many jobs per process; sharing one processor
+    means directory globbing, PDF parsing, and the extracted-text cache are
+    paid once per worker instead of once per participant.
+    """
+    return DocumentProcessor(documents_dir)
+
+
+def _write_page_texts(chunk_iter, out) -> int:
+    """
+    Write page texts from an iterator of page lists to a text file.
+
+    Consumes the iterator lazily so at most one worker's chunk of pages is
+    resident at a time. Returns the number of pages written.
+    """
+    pages_written = 0
+    for chunk in chunk_iter:
+        for text in chunk:
+            if pages_written:
+                out.write("\n\n")
+            out.write(text)
+            pages_written += 1
+    return pages_written
+
+
+def _open_pdf(pdf_path: str) -> fitz.Document:
+    """Open a PDF, buffering small files fully in memory first."""
+    path = Path(pdf_path)
+    if path.stat().st_size <= MAX_INMEMORY_PDF_BYTES:
+        return fitz.open(stream=path.read_bytes(), filetype="pdf")
+    return fitz.open(pdf_path)
+
+
+@functools.lru_cache(maxsize=None)
+def _encoding_for_model(model: str) -> tiktoken.Encoding:
+    """Get the tiktoken encoding for a model (cached; loading the BPE is slow)."""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def _extract_page_range(pdf_path: str, start: int, end: int) -> List[str]:
+    """
+    Extract text from pages [start, end) of a PDF.
+
+    Module-level so it can run in a worker process; each worker opens its
+    own fitz.Document (PyMuPDF documents are not shareable across processes).
+    """
+    doc = _open_pdf(pdf_path)
+    try:
+        texts = []
+        for page_num in range(start, end):
+            try:
+                text = doc[page_num].get_text("text")
+                if text.strip():
+                    texts.append(text)
+            except Exception as e:
+                logger.warning(f"Error extracting page {page_num + 1}: {e}")
+                continue
+        return texts
+    finally:
+        doc.close()
+
 
 class DocumentProcessor:
     """Processes PDF documents and extracts text for LLM context."""
     
-    def __init__(self, documents_dir: str = "./documents"):
+    def __init__(self, documents_dir: str = "./documents", model: str = "gpt-4o"):
         """
         Initialize the document processor.
-        
+
         Args:
             documents_dir: Directory containing PDF documents
+            model: OpenAI model whose tokenizer is used for token counts
         """
+        self.model = model
         self.documents_dir = Path(documents_dir)
         self.documents_dir.mkdir(exist_ok=True)
         self._cached_texts = {}
+        # On-disk cache of extracted text, keyed by (path, mtime, size) so
+        # repeated worker starts don't re-parse unchanged PDFs.
+        self._cache_dir = self.documents_dir / ".text_cache"
+        self._cache_dir.mkdir(exist_ok=True)
+        # Retrieval index over document chunks (built by build_index)
+        self._index: Optional[faiss.Index] = None
+        self._chunks: List[str] = []
+        self._openai_client: Optional[OpenAI] = None
+        # (sha256, text) of the last combined result so unchanged corpora
+        # return the same string object across load_documents calls
+        self._combined_cache: Optional[tuple] = None
+        # Encoded token ids keyed by content digest: the corpus is stable,
+        # so any follow-up truncation at a different budget is a pure
+        # O(budget) decode with no re-tokenization
+        self._encode_cache = {}
+
+    @property
+    def _client(self) -> OpenAI:
+        if self._openai_client is None:
+            self._openai_client = OpenAI()
+        return self._openai_client
+
+    def _cache_file_for(self, pdf_path: str) -> Path:
+        """Return the on-disk cache file for a PDF, keyed by path, mtime and size."""
+        st = os.stat(pdf_path)
+        key = hashlib.sha1(
+            f"{pdf_path}:{st.st_mtime_ns}:{st.st_size}".encode()
+        ).hexdigest()
+        return self._cache_dir / f"{key}.txt"
     
     def extract_text_from_pdf(self, pdf_path: str) -> str:
         """
@@ -38,25 +188,48 @@ class DocumentProcessor:
         """
         if pdf_path in self._cached_texts:
             return self._cached_texts[pdf_path]
-        
+
         try:
-            text_content = []
-            with open(pdf_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                num_pages = len(pdf_reader.pages)
-                
-                logger.info(f"Extracting text from {pdf_path} ({num_pages} pages)")
-                
-                for page_num, page in enumerate(pdf_reader.pages, 1):
-                    try:
-                        text = page.extract_text()
-                        if text.strip():
-                            text_content.append(text)
-                    except Exception as e:
-                        logger.warning(f"Error extracting page {page_num}: {e}")
-                        continue
-            
-            full_text = "\n\n".join(text_content)
+            cache_file = self._cache_file_for(pdf_path)
+            if cache_file.exists():
+                logger.info(f"Using cached text for {pdf_path}")
+                full_text = cache_file.read_text(encoding='utf-8')
+                self._cached_texts[pdf_path] = full_text
+                return full_text
+
+            doc = fitz.open(pdf_path)  # metadata only; no need to buffer
+            num_pages = doc.page_count
+            doc.close()
+
+            logger.info(f"Extracting text from {pdf_path} ({num_pages} pages)")
+
+            # Stream page text straight into the cache file as extraction
+            # results arrive, instead of accumulating every page string and
+            # joining - that held the full manual twice at peak. Write to a
+            # temp file and rename so a failed extraction leaves no cache.
+            tmp_file = cache_file.with_suffix('.tmp')
+            num_workers = min(num_pages, os.cpu_count() or 1)
+            with tmp_file.open('w', encoding='utf-8') as out:
+                if num_workers <= 1:
+                    _write_page_texts(iter([_extract_page_range(pdf_path, 0, num_pages)]), out)
+                else:
+                    # Split the page range evenly across one worker per core.
+                    pages_per_worker = -(-num_pages // num_workers)  # ceil division
+                    starts = list(range(0, num_pages, pages_per_worker))
+                    ends = [min(s + pages_per_worker, num_pages) for s in starts]
+
+                    _write_page_texts(
+                        _get_pdf_executor().map(
+                            _extract_page_range,
+                            [pdf_path] * len(starts),
+                            starts,
+                            ends,
+                        ),
+                        out,
+                    )
+            tmp_file.replace(cache_file)
+
+            full_text = cache_file.read_text(encoding='utf-8')
             self._cached_texts[pdf_path] = full_text
             return full_text
             
@@ -64,56 +237,191 @@ class DocumentProcessor:
             logger.error(f"Error processing PDF {pdf_path}: {e}")
             raise
     
+    def _select_pdfs(self, max_documents: int) -> List[Path]:
+        """Select the PDFs to load, in deterministic order."""
+        pdf_files = list(self.documents_dir.glob("*.pdf"))
+
+        if not pdf_files:
+            logger.warning(f"No PDF files found in {self.documents_dir}")
+            logger.info(f"Looking in directory: {self.documents_dir.absolute()}")
+            return []
+
+        # Sort by name so the combined text (and every prompt built from it)
+        # is byte-identical across runs - mtime ordering churned on any touch
+        # and invalidated downstream prefix caches
+        pdf_files.sort(key=lambda x: x.name)
+        return pdf_files[:max_documents]
+
+    @staticmethod
+    def _manifest_for(pdf_files: List[Path]) -> dict:
+        """Manifest of (path, mtime, size) identifying a PDF set's contents."""
+        return {
+            str(p): [p.stat().st_mtime_ns, p.stat().st_size] for p in pdf_files
+        }
+
+    def _check_manifest(self, pdf_files: List[Path]) -> tuple:
+        """
+        Check the saved manifest against the current PDF set.
+
+        Returns:
+            (manifest, cached_text) where cached_text is the combined text
+            if nothing changed, else None
+        """
+        # Short-circuit the whole pipeline when nothing changed: compare a
+        # manifest of (path, mtime, size) against the one saved with the
+        # last combined text
+        manifest = self._manifest_for(pdf_files)
+        manifest_file = self._cache_dir / "manifest.json"
+        combined_file = self._cache_dir / "combined.txt"
+
+        if manifest_file.exists() and combined_file.exists():
+            try:
+                if json.loads(manifest_file.read_text(encoding='utf-8')) == manifest:
+                    logger.info("Documents unchanged; using cached combined text")
+                    return manifest, combined_file.read_text(encoding='utf-8')
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable document manifest: {e}")
+
+        return manifest, None
+
+    def _load_one(self, pdf_file: Path) -> Optional[str]:
+        """Extract one PDF and wrap it in its document separator block."""
+        logger.info(f"Loading document: {pdf_file.name}")
+        try:
+            text = self.extract_text_from_pdf(str(pdf_file))
+        except Exception as e:
+            logger.error(f"Failed to load {pdf_file.name}: {e}")
+            return None
+
+        if text and text.strip():
+            logger.info(f"Successfully loaded {pdf_file.name} ({len(text)} characters)")
+            # Add clear document separator with filename
+            return f"\n{'='*80}\nDOCUMENT: {pdf_file.name}\n{'='*80}\n\n{text}\n"
+
+        logger.warning(f"Document {pdf_file.name} extracted but contains no text")
+        return None
+
+    def _combine_and_persist(self, combined_texts: List[str], manifest: dict) -> str:
+        """Join loaded document blocks and persist the combined cache."""
+        combined_texts = [block for block in combined_texts if block]
+
+        if not combined_texts:
+            logger.error("No documents were successfully loaded")
+            return ""
+
+        result = "\n".join(combined_texts)
+
+        # Persist the combined text and its manifest atomically so the next
+        # run can skip the pipeline entirely
+        combined_file = self._cache_dir / "combined.txt"
+        manifest_file = self._cache_dir / "manifest.json"
+        for target, content in ((combined_file, result),
+                                (manifest_file, json.dumps(manifest))):
+            tmp = target.with_suffix('.tmp')
+            tmp.write_text(content, encoding='utf-8')
+            tmp.replace(target)
+
+        return self._remember_combined(result)
+
     def load_documents(self, max_documents: int = 2) -> str:
         """
         Load and combine text from PDF documents in the documents directory.
-        
+
         Args:
             max_documents: Maximum number of documents to load (default: 2)
-            
+
         Returns:
             Combined text from all documents with clear document markers
         """
-        pdf_files = list(self.documents_dir.glob("*.pdf"))
-        
+        pdf_files = self._select_pdfs(max_documents)
         if not pdf_files:
-            logger.warning(f"No PDF files found in {self.documents_dir}")
-            logger.info(f"Looking in directory: {self.documents_dir.absolute()}")
             return ""
-        
-        # Sort by modification time (newest first) and take up to max_documents
-        pdf_files.sort(key=lambda x: x.stat().st_mtime, reverse=True)
-        pdf_files = pdf_files[:max_documents]
-        
+
+        manifest, cached = self._check_manifest(pdf_files)
+        if cached is not None:
+            return self._remember_combined(cached)
+
         logger.info(f"Found {len(pdf_files)} PDF file(s) to load")
-        
-        combined_texts = []
-        
-        for pdf_file in pdf_files:
-            logger.info(f"Loading document: {pdf_file.name}")
-            try:
-                text = self.extract_text_from_pdf(str(pdf_file))
-                if text and text.strip():
-                    # Add clear document separator with filename
-                    combined_texts.append(f"\n{'='*80}\nDOCUMENT: {pdf_file.name}\n{'='*80}\n\n{text}\n")
-                    logger.info(f"Successfully loaded {pdf_file.name} ({len(text)} characters)")
-                else:
-                    logger.warning(f"Document {pdf_file.name} extracted but contains no text")
-            except Exception as e:
-                logger.error(f"Failed to load {pdf_file.name}: {e}")
-                continue
-        
-        if not combined_texts:
-            logger.error("No documents were successfully loaded")
+
+        combined_texts = [self._load_one(pdf_file) for pdf_file in pdf_files]
+        return self._combine_and_persist(combined_texts, manifest)
+
+    async def load_documents_async(self, max_documents: int = 2) -> str:
+        """
+        Async variant of load_documents with concurrent per-document parsing.
+
+        Each PDF extracts in its own thread (MuPDF releases the GIL, and
+        large manuals fan out to the process pool anyway), so N documents
+        load in roughly the time of the slowest one while the event loop
+        stays free.
+
+        Args:
+            max_documents: Maximum number of documents to load (default: 2)
+
+        Returns:
+            Combined text from all documents with clear document markers
+        """
+        pdf_files = await asyncio.to_thread(self._select_pdfs, max_documents)
+        if not pdf_files:
             return ""
-        
-        result = "\n".join(combined_texts)
-        logger.info(f"Total combined document text: {len(result)} characters")
+
+        manifest, cached = await asyncio.to_thread(self._check_manifest, pdf_files)
+        if cached is not None:
+            return self._remember_combined(cached)
+
+        logger.info(f"Found {len(pdf_files)} PDF file(s) to load")
+
+        combined_texts = await asyncio.gather(
+            *[asyncio.to_thread(self._load_one, pdf_file) for pdf_file in pdf_files]
+        )
+        return self._combine_and_persist(list(combined_texts), manifest)
+
+    def _remember_combined(self, result: str) -> str:
+        """
+        Memoize the combined text by content hash.
+
+        Returns the identical string object when nothing changed so
+        downstream identity/equality-keyed caches keep hitting.
+        """
+        ctx_hash = hashlib.sha256(result.encode()).hexdigest()
+
+        if self._combined_cache is not None and self._combined_cache[0] == ctx_hash:
+            return self._combined_cache[1]
+
+        self._combined_cache = (ctx_hash, result)
+        logger.info(
+            f"Total combined document text: {len(result)} characters "
+            f"(context hash: {ctx_hash[:12]})"
+        )
         return result
     
+    @property
+    def _enc(self) -> tiktoken.Encoding:
+        return _encoding_for_model(self.model)
+
+    def encode(self, text: str) -> np.ndarray:
+        """
+        Encode text to token ids with the model's tokenizer.
+
+        Results are memoized by content digest as compact int32 arrays, so
+        encoding the (stable) corpus is paid once per worker regardless of
+        how many length checks or truncation budgets follow.
+        """
+        digest = hashlib.blake2b(text.encode(), digest_size=16).digest()
+        ids = self._encode_cache.get(digest)
+        if ids is None:
+            ids = np.asarray(
+                self._enc.encode(text, disallowed_special=()),
+                dtype=np.int32,
+            )
+            if len(self._encode_cache) >= 4:
+                self._encode_cache.clear()
+            self._encode_cache[digest] = ids
+        return ids
+
     def get_context_length(self, text: str) -> int:
-        """Get approximate token count (rough estimate: 1 token ≈ 4 characters)."""
-        return len(text) // 4
+        """Get the exact token count for the model's tokenizer."""
+        return len(self.encode(text))
     
     def truncate_to_fit_context(
         self, 
@@ -132,25 +440,290 @@ class DocumentProcessor:
         Returns:
             Truncated text
         """
-        available_tokens = max_tokens - reserved_tokens
-        current_tokens = self.get_context_length(text)
-        
-        if current_tokens <= available_tokens:
+        tokens = self.encode(text)
+
+        if len(tokens) <= max_tokens - reserved_tokens:
             return text
-        
-        # Truncate to fit
-        max_chars = available_tokens * 4
-        truncated = text[:max_chars]
-        
-        # Try to cut at a sentence boundary
-        last_period = truncated.rfind('.')
-        if last_period > max_chars * 0.9:  # If we can cut near a sentence
-            truncated = truncated[:last_period + 1]
-        
+
+        return self.truncate_ids_to_text(tokens, max_tokens, reserved_tokens)
+
+    def truncate_ids_to_text(
+        self,
+        tokens: List[int],
+        max_tokens: int,
+        reserved_tokens: int = 2000
+    ) -> str:
+        """
+        Decode a token id array truncated to fit the context window.
+
+        Takes pre-encoded ids so callers that already hold the token array
+        (e.g. for a length check) don't pay a second tokenization pass.
+
+        Args:
+            tokens: Token ids for the full text
+            max_tokens: Maximum tokens for the model
+            reserved_tokens: Tokens to reserve for prompt and response
+
+        Returns:
+            Decoded (possibly truncated) text
+        """
+        tokens = np.asarray(tokens, dtype=np.int32)
+        available_tokens = max_tokens - reserved_tokens
+
+        if len(tokens) <= available_tokens:
+            return self._enc.decode(tokens.tolist())
+
+        marker = "\n\n[...manual truncated...]\n"
+        budget = available_tokens - len(self._enc.encode(marker))
+
+        # Cut on the token array, preferring the last newline-bearing token
+        # within the budget so we don't slice mid-paragraph
+        cut = budget
+        search_floor = max(0, budget - 200)
+        for i in range(budget - 1, search_floor - 1, -1):
+            if "\n" in self._enc.decode([int(tokens[i])]):
+                cut = i + 1
+                break
+
+        truncated = self._enc.decode(tokens[:cut].tolist()) + marker
+
         logger.warning(
-            f"Document text truncated from {current_tokens} to "
-            f"{self.get_context_length(truncated)} tokens"
+            f"Document text truncated from {len(tokens)} to {cut} tokens"
         )
-        
+
         return truncated
 
+    def _split_into_chunks(self, text: str, source: str) -> List[str]:
+        """
+        Split text into ~CHUNK_TOKENS-token chunks with CHUNK_OVERLAP overlap.
+
+        Each chunk is prefixed with its source document name so the LLM can
+        cite the manual it came from.
+        """
+        tokens = self._enc.encode(text, disallowed_special=())
+        step = CHUNK_TOKENS - CHUNK_OVERLAP
+
+        chunks = []
+        for start in range(0, len(tokens), step):
+            chunk_tokens = tokens[start:start + CHUNK_TOKENS]
+            chunk_text = self._enc.decode(chunk_tokens).strip()
+            if chunk_text:
+                chunks.append(f"[{source}]\n{chunk_text}")
+            if start + CHUNK_TOKENS >= len(tokens):
+                break
+        return chunks
+
+    def _embed_batch(self, batch: List[str]) -> List[List[float]]:
+        """Embed one batch of texts with a single API call."""
+        response = self._client.embeddings.create(
+            model=EMBEDDING_MODEL,
+            input=batch,
+        )
+        return [item.embedding for item in response.data]
+
+    def _embed_texts(self, texts: List[str]) -> np.ndarray:
+        """Embed texts in large batches, with several requests in flight."""
+        batches = [
+            texts[i:i + EMBED_BATCH_SIZE]
+            for i in range(0, len(texts), EMBED_BATCH_SIZE)
+        ]
+
+        if len(batches) == 1:
+            batch_results = [self._embed_batch(batches[0])]
+        else:
+            # Embedding is network-bound; overlap requests to hide RTT
+            with ThreadPoolExecutor(max_workers=EMBED_CONCURRENCY) as executor:
+                batch_results = list(executor.map(self._embed_batch, batches))
+
+        vectors = [vec for batch in batch_results for vec in batch]
+        embeddings = np.array(vectors, dtype=np.float32)
+        faiss.normalize_L2(embeddings)  # cosine similarity via inner product
+        return embeddings
+
+    def build_index(self, max_documents: int = 2) -> int:
+        """
+        Build (or load) a retrieval index over chunks of the PDF documents.
+
+        Chunks each document, embeds the chunks, and stores the vectors in a
+        FAISS inner-product index. The index and chunks are persisted to the
+        cache directory so subsequent worker starts load instead of re-embed.
+
+        Args:
+            max_documents: Maximum number of documents to index
+
+        Returns:
+            Number of chunks in the index
+        """
+        index_file = self._cache_dir / "chunks.faiss"
+        chunks_file = self._cache_dir / "chunks.json"
+
+        pdf_files = self._select_pdfs(max_documents)
+        if not pdf_files:
+            return 0
+        manifest = self._manifest_for(pdf_files)
+
+        # Reuse the persisted index only while the manifest it was built
+        # from still matches the PDFs on disk - same invalidation rule as
+        # the combined-text cache
+        if index_file.exists() and chunks_file.exists():
+            try:
+                saved = json.loads(chunks_file.read_text(encoding='utf-8'))
+                if saved.get("manifest") == manifest:
+                    logger.info("Loading retrieval index from cache")
+                    self._index = faiss.read_index(str(index_file))
+                    self._chunks = saved["chunks"]
+                    return len(self._chunks)
+                logger.info("Documents changed; rebuilding retrieval index")
+            except (OSError, ValueError, AttributeError) as e:
+                logger.warning(f"Ignoring unreadable index cache: {e}")
+
+        chunks = []
+        for pdf_file in pdf_files:
+            try:
+                text = self.extract_text_from_pdf(str(pdf_file))
+            except Exception as e:
+                logger.error(f"Failed to index {pdf_file.name}: {e}")
+                continue
+            if text.strip():
+                chunks.extend(self._split_into_chunks(text, pdf_file.name))
+
+        if not chunks:
+            logger.error("No chunks extracted; retrieval index not built")
+            return 0
+
+        logger.info(f"Embedding {len(chunks)} chunks for the retrieval index")
+        embeddings = self._embed_texts(chunks)
+
+        # int8 scalar quantization: 4x smaller than FP32 with negligible
+        # recall loss at this scale, and faster top-K scans
+        index = faiss.IndexScalarQuantizer(
+            embeddings.shape[1],
+            faiss.ScalarQuantizer.QT_8bit,
+            faiss.METRIC_INNER_PRODUCT,
+        )
+        index.train(embeddings)
+        index.add(embeddings)
+
+        faiss.write_index(index, str(index_file))
+        chunks_file.write_text(
+            json.dumps({"manifest": manifest, "chunks": chunks}), encoding='utf-8'
+        )
+
+        self._index = index
+        self._chunks = chunks
+        logger.info(f"Retrieval index built with {len(chunks)} chunks")
+        return len(chunks)
+
+    def load_compiled_prompt(self, max_documents: int = 2) -> Optional[str]:
+        """
+        Return the precompiled system prompt if it is still fresh.
+
+        Freshness follows the same (path, mtime, size) manifest rule as the
+        combined-text and retrieval-index caches: if the PDFs on disk no
+        longer match the set the prompt was compiled from, return None so
+        the caller falls back to the live build.
+
+        Args:
+            max_documents: Maximum number of documents, matching the value
+                the live build would use
+
+        Returns:
+            The compiled prompt text, or None if missing or stale
+        """
+        prompt_file = self.documents_dir / ".system_prompt.txt"
+        manifest_file = self.documents_dir / ".system_prompt.manifest.json"
+        if not prompt_file.exists():
+            return None
+
+        try:
+            saved = json.loads(manifest_file.read_text(encoding='utf-8'))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Compiled prompt manifest unreadable ({e}); rebuilding live")
+            return None
+
+        if saved != self._manifest_for(self._select_pdfs(max_documents)):
+            logger.warning(
+                "Documents changed since the prompt was compiled; rebuilding live. "
+                "Re-run `python -m document_processor compile` to refresh it."
+            )
+            return None
+
+        return prompt_file.read_text(encoding='utf-8')
+
+    def search(self, query: str, top_k: int = 8) -> List[str]:
+        """
+        Return the top_k document chunks most relevant to a query.
+
+        Args:
+            query: Query text (typically the user's message)
+            top_k: Number of chunks to return
+
+        Returns:
+            List of chunk strings, most relevant first (empty if no index)
+        """
+        if self._index is None or not self._chunks:
+            return []
+
+        query_vec = self._embed_texts([query])
+        _, indices = self._index.search(query_vec, min(top_k, len(self._chunks)))
+        return [self._chunks[i] for i in indices[0] if i >= 0]
+
+
+def compile_prompt(model: str = "gpt-4o", max_documents: int = 2) -> Path:
+    """
+    Precompute the truncated system prompt and write it to disk.
+
+    The manuals change rarely, so the load -> truncate -> format pipeline
+    can run once at build/deploy time; the agent then reads the finished
+    prompt instead of rebuilding it on every startup. Also keeps the prompt
+    byte-identical across workers, which OpenAI prompt caching requires.
+
+    Args:
+        model: OpenAI model the prompt is budgeted for
+        max_documents: Maximum number of documents to include
+
+    Returns:
+        Path to the compiled prompt file
+    """
+    from llm_service import LLMService
+
+    processor = get_shared_processor()
+    llm_service = LLMService(model=model)
+
+    document_text = processor.load_documents(max_documents=max_documents)
+    if not document_text or not document_text.strip():
+        document_text = (
+            "No HVAC manuals are currently loaded. Please add PDF manuals "
+            "to the documents/ directory."
+        )
+    else:
+        document_text = processor.truncate_to_fit_context(
+            document_text,
+            max_tokens=llm_service.get_available_context_tokens(),
+            reserved_tokens=4000,
+        )
+
+    prompt = llm_service.create_system_prompt(document_text)
+
+    prompt_file = processor.documents_dir / ".system_prompt.txt"
+    manifest_file = processor.documents_dir / ".system_prompt.manifest.json"
+    manifest = processor._manifest_for(processor._select_pdfs(max_documents))
+    for f, data in ((prompt_file, prompt), (manifest_file, json.dumps(manifest))):
+        tmp_file = f.with_suffix('.tmp')
+        tmp_file.write_text(data, encoding='utf-8')
+        tmp_file.replace(f)
+
+    logger.info(f"Compiled system prompt to {prompt_file} ({len(prompt)} characters)")
+    return prompt_file
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+
+    if len(sys.argv) > 1 and sys.argv[1] == "compile":
+        compile_prompt()
+    else:
+        print("Usage: python -m document_processor compile")
+
@@ -2,13 +2,144 @@
 LLM Service for handling OpenAI API interactions with document context.
 """
 
+import asyncio
+import functools
+import hashlib
+import json
 import os
-from typing import Optional
-from openai import OpenAI
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Optional
+import faiss
+import httpx
+import numpy as np
+from openai import AsyncOpenAI
 import logging
 
+from semantic_cache import SemanticCache
+
 logger = logging.getLogger(__name__)
 
+_shared_client: Optional[AsyncOpenAI] = None
+
+# Model context window sizes (approximate)
+CONTEXT_WINDOWS = {
+    "gpt-4o": 128000,
+    "gpt-4-turbo": 128000,
+    "gpt-4": 8192,
+    "gpt-3.5-turbo": 16385,
+}
+
+
+@functools.lru_cache(maxsize=None)
+def get_context_window(model: str) -> int:
+    """Context window size for a model (default: large window)."""
+    return CONTEXT_WINDOWS.get(model, 128000)
+
+
+RESPONSE_CACHE_SIZE = 1024
+RESPONSE_CACHE_TTL = 900  # seconds
+
+# Questions technicians ask constantly; their embeddings are computed in a
+# single batched request at worker startup so the first occurrence of each
+# skips the per-query embedding round trip.
+SEED_QUERIES = [
+    "How do I reset the thermostat?",
+    "What does this error code mean?",
+    "How do I check the refrigerant charge?",
+    "What is the filter replacement procedure?",
+    "How do I test the capacitor?",
+    "What are the safety precautions before servicing?",
+    "How do I clean the condenser coils?",
+    "Why is the unit not cooling?",
+    "Why is the unit short cycling?",
+    "How do I check the blower motor?",
+]
+
+# Pre-computed query embeddings, populated by warm_query_embeddings
+_query_vec_cache = {}
+
+# Worker-scoped semantic cache: the entrypoint builds a fresh LLMService
+# per job, so an instance-level cache would die with every session; shared
+# here, answers to common questions survive across participants
+_shared_semantic_cache = SemanticCache()
+
+
+def warm_query_embeddings(api_key: Optional[str] = None) -> int:
+    """
+    Embed SEED_QUERIES in one batched request and cache the vectors.
+
+    Intended for the worker prewarm callback; one request replaces N
+    per-query embedding calls during live turns.
+
+    Returns:
+        Number of queries warmed
+    """
+    from openai import OpenAI
+
+    response = OpenAI(api_key=api_key).embeddings.create(
+        model="text-embedding-3-small",
+        input=SEED_QUERIES,
+    )
+    vectors = np.array([item.embedding for item in response.data], dtype=np.float32)
+    faiss.normalize_L2(vectors)
+
+    for query, vec in zip(SEED_QUERIES, vectors):
+        _query_vec_cache[query] = vec.reshape(1, -1)
+
+    logger.info(f"Warmed embeddings for {len(SEED_QUERIES)} seed queries")
+    return len(SEED_QUERIES)
+
+
+class _TTLCache:
+    """Minimal LRU cache with per-entry expiry (avoids a cachetools dep)."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()  # key -> (expires_at, value)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+# Worker-scoped exact-match cache, shared across jobs for the same reason
+# as the semantic cache above; the TTL bounds cross-session staleness
+_shared_response_cache = _TTLCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL)
+
+
+def get_shared_client(api_key: Optional[str] = None) -> AsyncOpenAI:
+    """
+    Return the process-wide AsyncOpenAI client.
+
+    All LLMService instances share one pooled HTTP/2 connection so requests
+    multiplex over warm connections instead of paying per-instance setup.
+    """
+    global _shared_client
+    if _shared_client is None:
+        _shared_client = AsyncOpenAI(
+            api_key=api_key,
+            http_client=httpx.AsyncClient(
+                http2=True,
+                limits=httpx.Limits(max_keepalive_connections=20),
+            ),
+        )
+    return _shared_client
+
 
 class LLMService:
     """Service for interacting with OpenAI LLM with document context."""
@@ -17,15 +148,19 @@ class LLMService:
         self,
         api_key: Optional[str] = None,
         model: str = "gpt-4o",
-        max_tokens: int = 4096
+        max_tokens: int = 4096,
+        retriever=None
     ):
         """
         Initialize the LLM service.
-        
+
         Args:
             api_key: OpenAI API key (defaults to OPENAI_API_KEY env var)
             model: OpenAI model to use (default: gpt-4o)
             max_tokens: Maximum tokens for the model context window
+            retriever: Optional DocumentProcessor with a built retrieval
+                index; when set, only query-relevant chunks are injected
+                into the system prompt instead of the full manuals
         """
         self.api_key = api_key or os.getenv("OPENAI_API_KEY")
         if not self.api_key:
@@ -33,33 +168,53 @@ class LLMService:
         
         self.model = model
         self.max_tokens = max_tokens
-        self.client = OpenAI(api_key=self.api_key)
-        
-        # Model context window sizes (approximate)
-        self.context_windows = {
-            "gpt-4o": 128000,
-            "gpt-4-turbo": 128000,
-            "gpt-4": 8192,
-            "gpt-3.5-turbo": 16385,
-        }
-        
-        self.available_context = self.context_windows.get(
-            model, 
-            128000  # Default to large context window
-        )
-        
+        self.retriever = retriever
+        self.client = get_shared_client(self.api_key)
+        # Near-duplicate questions skip the LLM round trip entirely
+        self.semantic_cache = _shared_semantic_cache
+        # Exact repeats ("repeat that", same drill-down) skip even the
+        # embedding call; entries expire so stale answers age out
+        self.response_cache = _shared_response_cache
+        # Rendered prompts keyed on (strict, context hash) so repeated jobs
+        # with the same manuals skip the template formatting
+        self._prompt_cache = {}
+
+        self.available_context = get_context_window(model)
+
         logger.info(f"Initialized LLM service with model: {model} (context: {self.available_context} tokens)")
     
-    def create_system_prompt(self, document_context: str) -> str:
+    def create_system_prompt(self, document_context: str, strict: bool = True) -> str:
         """
         Create system prompt with document context for HVAC servicing.
-        
+
         Args:
             document_context: Text from HVAC manuals
-            
+            strict: When True (default), the agent must refuse questions not
+                covered by the loaded manuals; when False it may fall back to
+                general HVAC knowledge with a verification caveat
+
         Returns:
             System prompt string
         """
+        # The rendered prompt is a pure function of (strict, context); key
+        # on a digest of the (large) context rather than the string itself
+        cache_key = (
+            strict,
+            hashlib.blake2b(document_context.encode(), digest_size=16).hexdigest(),
+        )
+        cached = self._prompt_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        prompt = self._render_system_prompt(document_context, strict)
+
+        if len(self._prompt_cache) >= 4:
+            self._prompt_cache.clear()
+        self._prompt_cache[cache_key] = prompt
+        return prompt
+
+    def _render_system_prompt(self, document_context: str, strict: bool) -> str:
+        """Render the system prompt template (uncached)."""
         # Check if documents were actually loaded
         if not document_context or "No HVAC manuals" in document_context:
             return """You are an expert HVAC (Heating, Ventilation, and Air Conditioning) service assistant. 
@@ -69,17 +224,33 @@ IMPORTANT: No HVAC manuals are currently loaded. Please inform the user that man
 
 Provide general HVAC knowledge and guidance, but always mention that specific procedures should be verified against the equipment's service manual."""
         
-        return f"""You are an expert HVAC (Heating, Ventilation, and Air Conditioning) service assistant. 
+        out_of_scope_rule = (
+            'If the user asks about something not in the provided manuals, say: '
+            '"That information is not in the loaded manuals. Please consult the '
+            'equipment\'s service manual."'
+            if strict else
+            'If the user asks about something not in the provided manuals, you may '
+            'answer from general HVAC knowledge, but state that the procedure should '
+            'be verified against the equipment\'s service manual.'
+        )
+
+        # The invariant document block comes first so OpenAI's automatic
+        # prompt caching can reuse it as a stable prefix across requests;
+        # any mutable content must stay below it or the cache never hits.
+        return f"""You are an expert HVAC (Heating, Ventilation, and Air Conditioning) service assistant.
 Your role is to help technicians diagnose, repair, and maintain HVAC systems.
 
 You have access to the following HVAC service manuals and documentation. Use this information to provide accurate, detailed guidance:
 
+MANUALS:
 {document_context}
 
+END MANUALS
+
 CRITICAL INSTRUCTIONS:
 1. ALWAYS reference the specific manual or section when providing information from the documents above
 2. Use exact procedures, specifications, and safety warnings from the manuals
-3. If the user asks about something not in the provided manuals, say: "That information is not in the loaded manuals. Please consult the equipment's service manual."
+3. {out_of_scope_rule}
 4. Prioritize safety warnings and precautions from the manuals
 5. Provide step-by-step instructions exactly as described in the manuals
 6. Use technical terminology from the manuals, but explain when necessary
@@ -87,54 +258,178 @@ CRITICAL INSTRUCTIONS:
 
 Respond in a clear, professional manner suitable for field technicians. Be specific and reference the documentation when possible."""
     
-    async def generate_response(
+    def _build_messages(
         self,
         user_message: str,
         document_context: str,
-        conversation_history: Optional[list] = None
-    ) -> str:
+        conversation_history: Optional[list] = None,
+        system_prompt: Optional[str] = None
+    ) -> list:
+        """Build the chat message list for a request."""
+        if system_prompt is None:
+            system_prompt = self.create_system_prompt(document_context)
+
+        messages = [
+            {"role": "system", "content": system_prompt}
+        ]
+
+        # Add conversation history if provided
+        if conversation_history:
+            messages.extend(conversation_history)
+
+        # Add current user message
+        messages.append({"role": "user", "content": user_message})
+        return messages
+
+    async def _embed_query(self, text: str) -> np.ndarray:
+        """Embed a query and L2-normalize it for cosine similarity."""
+        cached = _query_vec_cache.get(text)
+        if cached is not None:
+            return cached
+
+        response = await self.client.embeddings.create(
+            model="text-embedding-3-small",
+            input=[text],
+        )
+        vec = np.array([response.data[0].embedding], dtype=np.float32)
+        faiss.normalize_L2(vec)
+        return vec
+
+    async def stream_response(
+        self,
+        user_message: str,
+        document_context: str,
+        conversation_history: Optional[list] = None,
+        system_prompt: Optional[str] = None
+    ) -> AsyncIterator[str]:
         """
-        Generate a response using OpenAI API with document context.
-        
+        Stream a response from the OpenAI API as it is generated.
+
+        Yields text deltas as they arrive so downstream consumers (e.g. TTS)
+        can start speaking before the full completion is finished.
+
         Args:
             user_message: User's question or message
             document_context: Text from HVAC manuals
             conversation_history: Previous conversation messages (optional)
-            
-        Returns:
-            Generated response text
+            system_prompt: Pre-rendered system prompt; when set, it is sent
+                as-is instead of rendering one from document_context (the
+                voice agent passes its instructions here so the prompt is
+                not wrapped twice)
+
+        Yields:
+            Response text fragments in order
         """
+        # Exact-match check first: cheaper than the semantic cache since it
+        # needs no embedding round trip. Keyed on the prompt context plus
+        # the last few turns so "repeat that" within a session hits.
+        context_hash = hashlib.blake2b(
+            (system_prompt or document_context).encode(), digest_size=16
+        ).digest()
+        recent_turns = (conversation_history or [])[-4:] + [user_message]
+        cache_key = hashlib.blake2b(
+            context_hash + json.dumps(recent_turns, sort_keys=True).encode(),
+            digest_size=16,
+        ).hexdigest()
+
+        cached = self.response_cache.get(cache_key)
+        if cached is not None:
+            logger.debug("Exact response cache hit")
+            yield cached
+            return
+
+        # Semantically similar questions replay the cached answer without
+        # touching the LLM at all. The digest of the recent turns must also
+        # match, so a follow-up question never gets an answer generated
+        # under a different conversation.
+        history_digest = hashlib.blake2b(
+            json.dumps((conversation_history or [])[-4:], sort_keys=True).encode(),
+            digest_size=16,
+        ).hexdigest()
+        query_vec = None
+        if self.semantic_cache is not None:
+            try:
+                query_vec = await self._embed_query(user_message)
+                cached = self.semantic_cache.get(query_vec, history_digest)
+                if cached is not None:
+                    yield cached
+                    return
+            except Exception as e:
+                logger.warning(f"Semantic cache lookup failed: {e}")
+                query_vec = None
+
+        # Prefer retrieval: inject only the chunks relevant to this message
+        # instead of paying prefill cost on the full manuals. search() embeds
+        # the query with the sync client, so keep it off the event loop.
+        if self.retriever is not None:
+            chunks = await asyncio.to_thread(self.retriever.search, user_message, 8)
+            if chunks:
+                document_context = "\n\n".join(chunks)
+                system_prompt = None  # re-render from the retrieved chunks
+                logger.debug(f"Retrieved {len(chunks)} chunks for query")
+
+        parts = []
         try:
-            system_prompt = self.create_system_prompt(document_context)
-            
-            messages = [
-                {"role": "system", "content": system_prompt}
-            ]
-            
-            # Add conversation history if provided
-            if conversation_history:
-                messages.extend(conversation_history)
-            
-            # Add current user message
-            messages.append({"role": "user", "content": user_message})
-            
-            logger.debug(f"Calling OpenAI API with model: {self.model}")
-            
-            response = self.client.chat.completions.create(
+            messages = self._build_messages(
+                user_message, document_context, conversation_history,
+                system_prompt=system_prompt
+            )
+
+            logger.debug(f"Calling OpenAI API with model: {self.model} (streaming)")
+
+            stream = await self.client.chat.completions.create(
                 model=self.model,
                 messages=messages,
                 temperature=0.7,
                 max_tokens=1000,  # Response length limit
+                stream=True,
             )
-            
-            assistant_message = response.choices[0].message.content
-            logger.debug(f"Received response from OpenAI ({len(assistant_message)} chars)")
-            
-            return assistant_message
-            
+
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    parts.append(delta)
+                    yield delta
+
         except Exception as e:
             logger.error(f"Error generating LLM response: {e}")
-            return "I apologize, but I encountered an error processing your request. Please try again."
+            yield "I apologize, but I encountered an error processing your request. Please try again."
+            return
+
+        if parts:
+            full_response = "".join(parts)
+            self.response_cache.put(cache_key, full_response)
+            if query_vec is not None:
+                self.semantic_cache.put(
+                    query_vec, user_message, full_response, history_digest
+                )
+
+    async def generate_response(
+        self,
+        user_message: str,
+        document_context: str,
+        conversation_history: Optional[list] = None
+    ) -> str:
+        """
+        Generate a complete response using OpenAI API with document context.
+
+        Args:
+            user_message: User's question or message
+            document_context: Text from HVAC manuals
+            conversation_history: Previous conversation messages (optional)
+
+        Returns:
+            Generated response text
+        """
+        parts = []
+        async for delta in self.stream_response(
+            user_message, document_context, conversation_history
+        ):
+            parts.append(delta)
+
+        assistant_message = "".join(parts)
+        logger.debug(f"Received response from OpenAI ({len(assistant_message)} chars)")
+        return assistant_message
     
     def get_available_context_tokens(self) -> int:
         """Get the available context window size for the current model."""
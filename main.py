@@ -54,10 +54,16 @@ if __name__ == "__main__":
     import sys
     
     if len(sys.argv) > 1 and sys.argv[1] == "dev":
+        try:
+            import uvloop
+            uvloop.install()
+        except ImportError:
+            pass  # fall back to the default event loop
+
         from livekit.agents import cli as livekit_cli, WorkerOptions
-        from voice_agent import entrypoint
-        
-        livekit_cli.run_app(WorkerOptions(entrypoint_fnc=entrypoint))
+        from voice_agent import entrypoint, prewarm
+
+        livekit_cli.run_app(WorkerOptions(entrypoint_fnc=entrypoint, prewarm_fnc=prewarm))
     else:
         logger.info("Run with 'python main.py dev' to start the agent")
 
@@ -0,0 +1,109 @@
+"""
+Semantic response cache for common HVAC queries.
+
+Caches responses keyed on query embeddings so repeated or near-duplicate
+questions ("how do I reset the thermostat?") skip the LLM round trip.
+"""
+
+import itertools
+import logging
+from collections import OrderedDict
+from typing import Optional
+
+import faiss
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Cosine similarity above which two queries are treated as the same question
+SIMILARITY_THRESHOLD = 0.92
+MAX_ENTRIES = 500
+
+
+class SemanticCache:
+    """LRU cache of responses looked up by query-embedding similarity."""
+
+    def __init__(
+        self,
+        threshold: float = SIMILARITY_THRESHOLD,
+        max_entries: int = MAX_ENTRIES
+    ):
+        """
+        Initialize the cache.
+
+        Args:
+            threshold: Minimum cosine similarity for a hit
+            max_entries: Maximum cached responses before LRU eviction
+        """
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._index: Optional[faiss.Index] = None
+        self._entries: OrderedDict[int, tuple] = OrderedDict()  # id -> (query, response, context_digest)
+        self._next_id = itertools.count()
+
+    def _ensure_index(self, dim: int) -> None:
+        if self._index is None:
+            # IDMap so evicted entries can be removed from the index
+            self._index = faiss.IndexIDMap(faiss.IndexFlatIP(dim))
+
+    def get(self, query_vec: np.ndarray, context_digest: str = "") -> Optional[str]:
+        """
+        Look up a cached response for a (normalized) query embedding.
+
+        Args:
+            query_vec: L2-normalized embedding with shape (1, dim)
+            context_digest: Digest of the recent conversation turns the
+                response would be generated under; must match the digest
+                stored with the entry, so a context-dependent question
+                ("what does this error code mean?") never replays an
+                answer from a different conversation
+
+        Returns:
+            The cached response text, or None on a miss
+        """
+        if self._index is None or not self._entries:
+            return None
+
+        scores, ids = self._index.search(query_vec, 1)
+        score, entry_id = float(scores[0][0]), int(ids[0][0])
+
+        if entry_id < 0 or score < self.threshold or entry_id not in self._entries:
+            return None
+
+        query, response, entry_digest = self._entries[entry_id]
+        if entry_digest != context_digest:
+            return None
+
+        self._entries.move_to_end(entry_id)
+        logger.debug(f"Semantic cache hit (score {score:.3f}): {query!r}")
+        return response
+
+    def put(
+        self,
+        query_vec: np.ndarray,
+        query: str,
+        response: str,
+        context_digest: str = ""
+    ) -> None:
+        """
+        Store a response under a (normalized) query embedding.
+
+        Args:
+            query_vec: L2-normalized embedding with shape (1, dim)
+            query: The query text (kept for logging)
+            response: The response text to cache
+            context_digest: Digest of the recent conversation turns the
+                response was generated under
+        """
+        self._ensure_index(query_vec.shape[1])
+
+        entry_id = next(self._next_id)
+        self._index.add_with_ids(query_vec, np.array([entry_id], dtype=np.int64))
+        self._entries[entry_id] = (query, response, context_digest)
+
+        while len(self._entries) > self.max_entries:
+            oldest_id, _ = self._entries.popitem(last=False)
+            self._index.remove_ids(np.array([oldest_id], dtype=np.int64))
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -3,10 +3,9 @@ Test script to verify document processing works correctly.
 Run this before starting the voice agent to ensure documents are loaded properly.
 """
 
-import os
 import logging
 from dotenv import load_dotenv
-from document_processor import DocumentProcessor
+from document_processor import get_shared_processor
 from llm_service import LLMService
 
 logging.basicConfig(
@@ -23,8 +22,8 @@ def main():
     
     logger.info("Testing document processor...")
     
-    # Initialize document processor
-    doc_processor = DocumentProcessor()
+    # Use the same shared processor the voice agent uses
+    doc_processor = get_shared_processor()
     
     # Load documents
     document_text = doc_processor.load_documents(max_documents=2)
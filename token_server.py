@@ -3,9 +3,12 @@ Simple token server for generating LiveKit access tokens for the web client.
 Run this alongside your agent to generate tokens for web clients.
 """
 
+import functools
 import os
 import logging
-from flask import Flask, jsonify, request
+import secrets
+import orjson
+from flask import Flask, request
 from flask_cors import CORS
 from dotenv import load_dotenv
 
@@ -36,6 +39,26 @@ CORS(app)  # Enable CORS for web client
 
 logger = logging.getLogger(__name__)
 
+
+@functools.lru_cache(maxsize=256)
+def _grant_for(room: str):
+    """Build the video grant for a room once; it's identical per room."""
+    return VideoGrant(
+        room_join=True,
+        room=room,
+        can_publish=True,
+        can_subscribe=True,
+    )
+
+
+def _json_response(payload, status=200):
+    """Serialize a response with orjson (2-5x faster than stdlib json)."""
+    return app.response_class(
+        orjson.dumps(payload),
+        status=status,
+        mimetype="application/json",
+    )
+
 # Get credentials from environment
 LIVEKIT_URL = os.getenv("LIVEKIT_URL")
 LIVEKIT_API_KEY = os.getenv("LIVEKIT_API_KEY")
@@ -46,30 +69,34 @@ LIVEKIT_API_SECRET = os.getenv("LIVEKIT_API_SECRET")
 def generate_token():
     """Generate a LiveKit access token for a user."""
     try:
-        data = request.json or {}
-        identity = data.get("identity", "user-" + os.urandom(4).hex())
+        # Malformed client JSON is the client's fault: report it as a 400
+        # instead of letting it surface as a 500 with a server traceback
+        raw = request.get_data()
+        try:
+            data = orjson.loads(raw) if raw else {}
+        except orjson.JSONDecodeError:
+            return _json_response({"error": "Invalid JSON in request body"}, status=400)
+        if not isinstance(data, dict):
+            return _json_response({"error": "Request body must be a JSON object"}, status=400)
+
+        identity = data.get("identity", "user-" + secrets.token_hex(4))
         room_name = data.get("room", "hvac-room")
         name = data.get("name", "User")
         
         # Ensure identity is a non-empty string
         if not identity or not isinstance(identity, str) or len(identity.strip()) == 0:
-            identity = "user-" + os.urandom(4).hex()
+            identity = "user-" + secrets.token_hex(4)
         
         identity = identity.strip()
         
         if not LIVEKIT_API_KEY or not LIVEKIT_API_SECRET:
-            return jsonify({"error": "LiveKit credentials not configured"}), 500
+            return _json_response({"error": "LiveKit credentials not configured"}, status=500)
         
         logger.info(f"Generating token - Identity: '{identity}', Room: '{room_name}', Name: '{name}'")
         
-        # Use LiveKit's official AccessToken class
-        grant = VideoGrant(
-            room_join=True,
-            room=room_name,
-            can_publish=True,
-            can_subscribe=True,
-        )
-        
+        # Use LiveKit's official AccessToken class with the cached grant
+        grant = _grant_for(room_name)
+
         token = AccessToken(LIVEKIT_API_KEY, LIVEKIT_API_SECRET) \
             .with_identity(identity) \
             .with_name(name) \
@@ -78,20 +105,20 @@ def generate_token():
         
         logger.info(f"Generated token successfully for identity: '{identity}', room: '{room_name}'")
         
-        return jsonify({
+        return _json_response({
             "token": token,
             "url": LIVEKIT_URL,
             "room": room_name,
         })
     except Exception as e:
         logger.error(f"Error generating token: {e}", exc_info=True)
-        return jsonify({"error": str(e)}), 500
+        return _json_response({"error": str(e)}, status=500)
 
 
 @app.route("/health", methods=["GET"])
 def health():
     """Health check endpoint."""
-    return jsonify({"status": "ok"})
+    return _json_response({"status": "ok"})
 
 
 if __name__ == "__main__":
@@ -103,4 +130,6 @@ if __name__ == "__main__":
     
     logger.info("Starting token server on http://localhost:8080")
     logger.info("Token endpoint: http://localhost:8080/token")
-    app.run(host="0.0.0.0", port=8080, debug=True)
\ No newline at end of file
+    # threaded=True so concurrent /token requests at a room-join spike
+    # don't serialize behind each other
+    app.run(host="0.0.0.0", port=8080, debug=True, threaded=True)
\ No newline at end of file
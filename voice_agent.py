@@ -3,7 +3,9 @@ LiveKit Voice Agent for HVAC servicing with document context.
 """
 
 import asyncio
+import hashlib
 import logging
+import os
 from livekit import agents
 from livekit.agents import (
     JobContext,
@@ -14,52 +16,339 @@ from livekit.agents import (
 )
 from livekit.plugins import openai
 
-from document_processor import DocumentProcessor
-from llm_service import LLMService
+from document_processor import get_shared_processor
+from llm_service import LLMService, get_shared_client, warm_query_embeddings
 
 logger = logging.getLogger(__name__)
 
+# The Realtime API runs STT, LLM, and TTS over one WebSocket with
+# server-side context reuse between turns; set HVAC_USE_REALTIME=0 to fall
+# back to the separate STT -> LLM -> TTS pipeline.
+USE_REALTIME = os.getenv("HVAC_USE_REALTIME", "1") != "0"
+REALTIME_MODEL = os.getenv("HVAC_REALTIME_MODEL", "gpt-4o-realtime-preview")
+
+# tts-1 is the low-latency synthesis model; the LiveKit plugin streams its
+# chunked PCM into the room as frames arrive, so first audio plays while
+# the rest of the utterance is still synthesizing.
+TTS_MODEL = os.getenv("HVAC_TTS_MODEL", "tts-1")
+
+# Optional self-hosted completion endpoint (e.g. vLLM started with
+# --enable-prefix-caching) used by the non-realtime pipeline; the shared
+# document prefix is then served from the server's KV cache every turn.
+LLM_BASE_URL = os.getenv("LLM_BASE_URL")
+
+# Retrieval mode: build the chunk index at startup and inject only the
+# top query-relevant chunks per message instead of the full manuals. Off
+# by default because the default strategy is the stable full-prefix
+# prompt that provider-side prompt caching relies on. Retrieval needs the
+# per-turn llm_node hook, which the Realtime API does not expose, so this
+# forces the STT -> LLM -> TTS pipeline regardless of HVAC_USE_REALTIME.
+USE_RAG = os.getenv("HVAC_USE_RAG", "0") != "0"
+
+# Session-level instructions for retrieval mode. The per-turn system
+# prompt is rendered from the retrieved chunks in llm_node, so the
+# instructions stay lean instead of carrying the full manuals.
+RAG_INSTRUCTIONS = (
+    "You are an expert HVAC (Heating, Ventilation, and Air Conditioning) "
+    "service assistant. Relevant excerpts from the loaded service manuals "
+    "are provided with each question; base your answers on them and "
+    "reference the manual name when you do."
+)
+
+# Plugin instances cached at worker scope: constructing STT/LLM/TTS per job
+# re-initialized HTTP clients (and re-paid model setup) on every
+# participant join. Populated in prewarm, lazily on first use otherwise.
+_plugin_cache = {}
+
+
+def _cached_plugin(name: str, factory):
+    """Return the worker-scoped instance for a plugin, creating it once."""
+    if name not in _plugin_cache:
+        _plugin_cache[name] = factory()
+    return _plugin_cache[name]
+
+
+def _pipeline_llm(model: str, prefix_cache_key: str):
+    """
+    Build the pipeline-path LLM, honoring a prefix-caching endpoint.
+
+    When LLM_BASE_URL points at a self-hosted server with prefix caching
+    enabled, pin a stable cache id for the invariant document prefix so
+    every turn (and every session with the same manuals) hits the same
+    cache entry instead of re-prefilling the whole manual block.
+    """
+    if not LLM_BASE_URL:
+        # Share the worker's pooled HTTP/2 client with STT/TTS so the three
+        # stages multiplex one connection instead of three handshakes
+        return openai.LLM(model=model, client=get_shared_client())
+
+    from openai import AsyncOpenAI
+
+    client = AsyncOpenAI(
+        base_url=LLM_BASE_URL,
+        default_headers={"x-prefix-cache-id": prefix_cache_key},
+    )
+    return openai.LLM(model=model, client=client)
+
+
+class HVACVoiceAgent(agents.Agent):
+    """
+    HVAC service voice agent.
+
+    The system prompt keeps the invariant tokens first (boilerplate, then
+    document block, then instructions) so the long shared prefix is reusable
+    by provider-side prompt/KV caching; only the per-turn user message
+    changes between requests.
+    """
+
+    # Note: __slots__ would be a no-op here - the Agent base class has no
+    # __slots__, so instances carry a __dict__ regardless
+    def __init__(self, system_prompt: str, llm_service: LLMService):
+        self.llm_service = llm_service
+        # The prompt embeds the manuals, so it is the shared prefix. Keep
+        # only its hash: the Agent base class already holds the full string
+        # as instructions, and duplicating it per instance doubled the
+        # per-agent heap footprint of the manual text.
+        self.document_context_hash = hashlib.sha256(system_prompt.encode()).hexdigest()
+        prefix_cache_key = self.document_context_hash
+
+        if USE_REALTIME and not USE_RAG:
+            # One WebSocket for STT+LLM+TTS; the document context is sent
+            # once at session init and retained server-side across turns
+            super().__init__(
+                instructions=system_prompt,
+                llm=_cached_plugin("realtime", lambda: openai.realtime.RealtimeModel(
+                    model=REALTIME_MODEL,
+                    voice="alloy",
+                )),
+            )
+        else:
+            super().__init__(
+                instructions=system_prompt,
+                stt=_cached_plugin("stt", lambda: openai.STT(
+                    use_realtime=True, client=get_shared_client()
+                )),
+                # Key on model and prefix hash: a bare "llm" entry pinned
+                # the first job's x-prefix-cache-id forever, so sessions
+                # after a manual/prompt change reused a stale cache id
+                llm=_cached_plugin(
+                    f"llm:{llm_service.model}:{prefix_cache_key}"
+                    if LLM_BASE_URL else f"llm:{llm_service.model}",
+                    lambda: _pipeline_llm(llm_service.model, prefix_cache_key),
+                ),
+                tts=_cached_plugin("tts", lambda: openai.TTS(
+                    model=TTS_MODEL, voice="alloy", client=get_shared_client()
+                )),
+            )
+
+    async def llm_node(self, chat_ctx, tools, model_settings):
+        """
+        Route pipeline turns through LLMService instead of the raw plugin.
+
+        This is what puts the response caches and retrieval in the live
+        path: exact and semantic cache hits skip the LLM round trip, and in
+        retrieval mode the per-turn prompt carries only the chunks relevant
+        to the question. Turns that are not plain text (tool calls, empty
+        transcripts) fall through to the default plugin call.
+        """
+        items = list(chat_ctx.items)
+        last = items[-1] if items else None
+        if (
+            tools
+            or not isinstance(last, llm.ChatMessage)
+            or last.role != "user"
+            or not last.text_content
+        ):
+            async for chunk in agents.Agent.default.llm_node(
+                self, chat_ctx, tools, model_settings
+            ):
+                yield chunk
+            return
+
+        history = [
+            {"role": item.role, "content": item.text_content}
+            for item in items[:-1]
+            if isinstance(item, llm.ChatMessage)
+            and item.role in ("user", "assistant")
+            and item.text_content
+        ]
+
+        # In retrieval mode the prompt is rendered from the retrieved
+        # chunks; otherwise the session instructions (full manuals baked
+        # in) are sent as-is so the stable prefix stays byte-identical.
+        async for delta in self.llm_service.stream_response(
+            last.text_content,
+            document_context="",
+            conversation_history=history,
+            system_prompt=None if USE_RAG else self.instructions,
+        ):
+            yield delta
+
+
+def prewarm(proc: agents.JobProcess):
+    """Build the prompt and plugin instances once at worker startup."""
+    logger.info("Prewarming worker: loading HVAC manuals")
+
+    if USE_RAG:
+        # Chunk + embed the manuals once per worker so per-message
+        # retrieval is a pure index lookup; the full-manual prompt is
+        # never sent in this mode, so skip building it
+        try:
+            get_shared_processor().build_index(max_documents=2)
+        except Exception as e:
+            logger.error(f"Retrieval index build failed: {e}")
+    else:
+        # Run the full document pipeline now and stash the results so jobs
+        # read a finished string instead of re-parsing PDFs per participant
+        try:
+            system_prompt, _ = _build_system_prompt_sync(
+                get_shared_processor(), LLMService()
+            )
+            proc.userdata["system_prompt"] = system_prompt
+        except Exception as e:
+            logger.error(f"Prewarm prompt build failed (will build per job): {e}")
+
+    # Preload the tokenizer: first use of a tiktoken encoding downloads and
+    # caches the BPE file, which otherwise lands on the first job when the
+    # compiled-prompt path skips tokenization during the prompt build
+    get_shared_processor().get_context_length("warmup")
+
+    # Construct the shared OpenAI client and make the cheapest
+    # authenticated call so DNS resolution doesn't hit the first turn
+    get_shared_client()
+    try:
+        from openai import OpenAI
+        OpenAI().models.list()
+    except Exception as e:
+        logger.debug(f"OpenAI warmup call failed: {e}")
+
+    # One batched embedding request covers all the common HVAC questions
+    # instead of one round trip each as users first ask them. The vectors
+    # only feed the semantic cache lookups in llm_node, which never runs
+    # on the realtime path - don't pay the API call there.
+    if not USE_REALTIME or USE_RAG:
+        try:
+            warm_query_embeddings()
+        except Exception as e:
+            logger.warning(f"Seed query embedding warmup failed: {e}")
+
+    # Instantiate the voice plugins ahead of the first job so participant
+    # joins don't pay client/model setup cost
+    if USE_REALTIME and not USE_RAG:
+        _cached_plugin("realtime", lambda: openai.realtime.RealtimeModel(
+            model=REALTIME_MODEL,
+            voice="alloy",
+        ))
+    else:
+        _cached_plugin("stt", lambda: openai.STT(
+            use_realtime=True, client=get_shared_client()
+        ))
+        _cached_plugin("tts", lambda: openai.TTS(
+            model=TTS_MODEL, voice="alloy", client=get_shared_client()
+        ))
+
+
+def _build_system_prompt_sync(doc_processor, llm_service) -> tuple:
+    """
+    Build the system prompt, preferring the precompiled one on disk.
+
+    `python -m document_processor compile` writes the fully
+    loaded/truncated/formatted prompt ahead of time; reading it back is
+    microseconds versus seconds for the live pipeline, and the compiled
+    prompt is byte-identical across workers for prompt caching.
+
+    Returns:
+        (system_prompt, document_text) tuple
+    """
+    system_prompt = doc_processor.load_compiled_prompt(max_documents=2)
+    if system_prompt is not None:
+        logger.info(f"Using precompiled system prompt ({len(system_prompt)} characters)")
+        return system_prompt, ""
 
-async def entrypoint(ctx: JobContext):
-    """Entry point for the LiveKit agent job."""
-    logger.info("Starting HVAC Voice Agent job")
-    logger.info(f"Room: {ctx.room.name}, Room SID: {ctx.room.sid}")
-    
     # Load documents FIRST - this is critical for the agent to have context
     logger.info("Loading HVAC manuals...")
-    doc_processor = DocumentProcessor()
     document_text = doc_processor.load_documents(max_documents=2)
-    
+
     if not document_text or len(document_text.strip()) == 0:
         logger.error("No documents found! Please add PDF files to the 'documents/' directory.")
         logger.warning("Agent will run without document context.")
         document_text = "No HVAC manuals are currently loaded. Please add PDF manuals to the documents/ directory."
     else:
         logger.info(f"Documents loaded successfully. Raw text length: {len(document_text)} characters")
-    
-    # Initialize LLM service
-    llm_service = LLMService()
+
     available_tokens = llm_service.get_available_context_tokens()
     logger.info(f"Model context window: {available_tokens} tokens")
-    
+
     # Truncate document text to fit context window (reserve space for conversation)
     if document_text and len(document_text.strip()) > 0:
-        original_length = doc_processor.get_context_length(document_text)
-        document_text = doc_processor.truncate_to_fit_context(
-            document_text,
-            max_tokens=available_tokens,
-            reserved_tokens=4000  # Reserve tokens for system prompt, conversation history, and responses
-        )
-        final_length = doc_processor.get_context_length(document_text)
+        # Encode once; the length check and the truncation share the same
+        # token id array instead of tokenizing the corpus twice
+        ids = doc_processor.encode(document_text)
+        original_length = len(ids)
+        budget = available_tokens - 4000  # Reserve tokens for system prompt, conversation history, and responses
+        if original_length > budget:
+            document_text = doc_processor.truncate_ids_to_text(
+                ids,
+                max_tokens=available_tokens,
+                reserved_tokens=4000,
+            )
+        final_length = min(original_length, budget)
         logger.info(f"Document context: {final_length} tokens (was {original_length} tokens)")
-        
+
         # Log a sample of the document to verify it loaded
         sample = document_text[:200] + "..." if len(document_text) > 200 else document_text
         logger.debug(f"Document sample: {sample}")
-    
-    # Create system prompt with document context
+
     system_prompt = llm_service.create_system_prompt(document_context=document_text)
     logger.info(f"System prompt created ({len(system_prompt)} characters)")
+    return system_prompt, document_text
+
+
+async def _build_system_prompt(doc_processor, llm_service) -> str:
+    """Run the prompt pipeline off the event loop and return the prompt."""
+    # Parse the PDFs concurrently up front (unless a fresh compiled prompt
+    # makes loading unnecessary); the sync builder below then gets an
+    # instant cache hit for the combined text
+    if await asyncio.to_thread(doc_processor.load_compiled_prompt, 2) is None:
+        await doc_processor.load_documents_async(max_documents=2)
+
+    # PDF parsing and tokenization are blocking CPU+I/O work; keep them off
+    # the event loop so LiveKit signaling stays responsive during startup
+    system_prompt, _ = await asyncio.to_thread(
+        _build_system_prompt_sync, doc_processor, llm_service
+    )
+    return system_prompt
+
+
+async def _resolve_system_prompt(ctx: JobContext, doc_processor, llm_service) -> str:
+    """Use the prompt prepared at worker startup, or build it live."""
+    if USE_RAG:
+        # Per-turn prompts come from the retrieval index; the session only
+        # needs the lean role instructions
+        return RAG_INSTRUCTIONS
+    system_prompt = ctx.proc.userdata.get("system_prompt")
+    if system_prompt is not None:
+        return system_prompt
+    return await _build_system_prompt(doc_processor, llm_service)
+
+
+async def entrypoint(ctx: JobContext):
+    """Entry point for the LiveKit agent job."""
+    logger.info("Starting HVAC Voice Agent job")
+    logger.info("Room: %s, Room SID: %s", ctx.room.name, ctx.room.sid)
+
+    doc_processor = get_shared_processor()
+    llm_service = LLMService(retriever=doc_processor if USE_RAG else None)
+
+    # Participant-join RTT and prompt resolution are independent; run them
+    # concurrently so cold starts hide whichever finishes first
+    async with asyncio.TaskGroup() as tg:
+        tg.create_task(ctx.wait_for_participant())
+        prompt_task = tg.create_task(
+            _resolve_system_prompt(ctx, doc_processor, llm_service)
+        )
+
+    system_prompt = prompt_task.result()
     
     def _log_conversation(event):
         item = getattr(event, "item", None)
@@ -70,19 +359,20 @@ async def entrypoint(ctx: JobContext):
         if not text:
             return
         
+        # Fires on every conversation turn: lazy %-formatting (and an
+        # enabled-level guard for the derived stats) so nothing is computed
+        # when INFO is filtered out
+        if not logger.isEnabledFor(logging.INFO):
+            return
+
         if item.role == "user":
-            logger.info(f"👤 USER SAID: {text}")
+            logger.info("👤 USER SAID: %s", text)
         elif item.role == "assistant":
-            logger.info(f"🤖 AGENT RESPONSE: {text}")
-            logger.info(f"   Response length: {len(text)} characters")
-            logger.info(f"   Response tokens (approx): {len(text) // 4}")
+            logger.info("🤖 AGENT RESPONSE: %s", text)
+            logger.info("   Response length: %d characters", len(text))
+            logger.info("   Response tokens (approx): %d", len(text) // 4)
     
-    hvac_agent = agents.Agent(
-        instructions=system_prompt,
-        stt=openai.STT(use_realtime=True),
-        llm=openai.LLM(model=llm_service.model),
-        tts=openai.TTS(voice="alloy"),
-    )
+    hvac_agent = HVACVoiceAgent(system_prompt, llm_service)
     
     session = AgentSession()
     session.on("conversation_item_added", _log_conversation)
@@ -94,9 +384,11 @@ async def entrypoint(ctx: JobContext):
     await session.start(hvac_agent, room=ctx.room)
     logger.info("Voice agent started and listening")
     
-    # Keep the agent running
+    # Hold the job open until LiveKit cancels it (participant left, worker
+    # draining) instead of a blind timed sleep that tears the agent down
+    # after an arbitrary hour
     try:
-        await asyncio.sleep(3600)  # Run for up to 1 hour (or until disconnected)
+        await asyncio.Event().wait()
     except asyncio.CancelledError:
         logger.info("Agent session cancelled")
     finally:
@@ -105,6 +397,14 @@ async def entrypoint(ctx: JobContext):
 
 
 if __name__ == "__main__":
+    # uvloop schedules the thousands of per-frame coroutine hops in the
+    # voice pipeline noticeably faster than the default loop
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass  # fall back to the default event loop
+
     # Configure logging
     logging.basicConfig(
         level=logging.INFO,
@@ -112,4 +412,4 @@ if __name__ == "__main__":
     )
     
     # Run the agent
-    cli.run_app(WorkerOptions(entrypoint_fnc=entrypoint))
\ No newline at end of file
+    cli.run_app(WorkerOptions(entrypoint_fnc=entrypoint, prewarm_fnc=prewarm))
\ No newline at end of file